@@ -9,10 +9,16 @@ https://gixtools.net
 import os
 import sys
 import time
+import array
 import struct
 import socket
+import binascii
+import ctypes
+import ctypes.util
+import multiprocessing
+from itertools import islice, chain
+from collections import OrderedDict
 
-from netaddr import IPNetwork
 from daemon import daemon
 import threading
 import Queue
@@ -30,12 +36,35 @@ from tornado.log import enable_pretty_logging
 from gixflow_config import config
 from gixflow_stats import netflow_sources
 from gixflow_classes import *
+from gixflow_recvmmsg import RecvInit
+from gixflow_queue import RingQueue, ProcessQueues
 
 #
 # Main code - Do not modify the code below the line.
 #
 Running = False
 
+# Prefixes added to and expired from the prefix cache of a NetFlow worker process, reported to the main process.
+# None in the main process.
+prefix_updates = None
+
+# Packets taken from the process queue by a NetFlow worker process, reported to the main process.
+process_packets_taken = 0
+
+# Socket and address used to forward received NetFlow packets, created once in GIXFlow().
+fwd_sock = None
+fwd_addr = None
+
+# IPv4 /24 network (unsigned 32-bit integer) -> (ASN, expiry), checked before the prefix cache.
+asn_cache = {}
+
+# IPv4 address (unsigned 32-bit integer) -> dotted-quad string, for addresses seen in flow records.
+ip4_cache = {}
+
+# IPv4 /24 network (unsigned 32-bit integer) or IPv6 /48 network (packed) -> expiry,
+# for networks where the DNS lookup returned no data or failed. Kept out of the prefix cache.
+neg_cache = OrderedDict()
+
 
 def RFCPrefixTable():
     prefix_cache = radix.Radix()
@@ -130,148 +159,420 @@ def RFCPrefixTable():
     return prefix_cache
 
 
-def IP2ASN_dns(adns_resolver, ip_ver, ip_addr, ip2asn_mode):
-    global Running, prefix_cache, netflow_sources
+def CPU_Affinity(cpus):
+    # Pins the calling thread to the given set of CPUs, silently ignored when not supported.
+    if not cpus:
+        return
 
     try:
-        if ip2asn_mode == "cymru":
-            if ip_ver == 4:
-                ip2asn_domain = ".origin.asn.cymru.com"
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
 
-            else:
-                ip2asn_domain = ".origin6.asn.cymru.com"
+        else:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            cpu_bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+            cpu_mask = (ctypes.c_ulong * (1024 // cpu_bits))()
+            for cpu in cpus:
+                cpu_mask[cpu // cpu_bits] |= 1 << (cpu % cpu_bits)
+            libc.sched_setaffinity(0, ctypes.sizeof(cpu_mask), cpu_mask)
 
-        elif ip2asn_mode == "routeviews":
-            if ip_ver == 4:
-                ip2asn_domain = ".asn.routeviews.org"
+    except:
+        pass
 
-            else:
-                # IPv6 addresses mapping is not supported by Route Views
-                # ip2asn_domain = ""
-                asn = ASNtype.Unknown
-                return asn
+
+def CPU_Receivers():
+    if not config["cpu_affinity_enable"]:
+        return set()
+
+    return set([config["flow_receiver_cpu"]])
+
+
+def CPU_Workers():
+    if not config["cpu_affinity_enable"]:
+        return set()
+
+    try:
+        cpus = set(range(multiprocessing.cpu_count()))
+
+    except NotImplementedError:
+        return set()
+
+    return cpus - CPU_Receivers()
+
+
+def Cache_Set(cache, cache_size, key, value):
+    # Bounded dict, random eviction: dict.popitem() removes an arbitrary entry.
+    if len(cache) >= cache_size:
+        try:
+            cache.popitem()
+        except KeyError:
+            pass
+
+    cache[key] = value
+
+
+def ASN_Cache_Get(ip_net_u32, ts):
+    # Returns the cached ASN of the /24 network, None when the prefix cache has to be searched.
+    asn_hit = asn_cache.get(ip_net_u32)
+    if asn_hit is not None and asn_hit[0] is not None and (asn_hit[1] == 0 or asn_hit[1] >= ts):
+        return asn_hit[0]
+
+    return None
+
+
+def ASN_Cache_Add(ip_net_u32, ts):
+    global prefix_cache
+
+    # Caches the ASN of the prefix covering the whole /24 network.
+    # A /24 network containing a more specific prefix is marked with an ASN of None
+    # (until the first of those prefixes expires), its addresses are always looked up in the prefix cache.
+    with lock:
+        asn_hit = asn_cache.get(ip_net_u32)
+        if asn_hit is not None and asn_hit[0] is None and (asn_hit[1] == 0 or asn_hit[1] >= ts):
+            return
+
+        ip_net = IPv4_ntoa(ip_net_u32) + "/" + str(ASNCache.Prefixlen)
+        split_exp = None
+        for rnode in prefix_cache.search_covered(ip_net):
+            # Expired prefixes are only deleted when looked up, they no longer split the /24 network.
+            if rnode.data["exp"] != 0 and rnode.data["exp"] < ts:
+                continue
+
+            if rnode.prefixlen > ASNCache.Prefixlen:
+                if split_exp is None or (rnode.data["exp"] != 0 and (split_exp == 0 or rnode.data["exp"] < split_exp)):
+                    split_exp = rnode.data["exp"]
+
+        if split_exp is not None:
+            Cache_Set(asn_cache, ASNCache.Size, ip_net_u32, (None, split_exp))
+            return
+
+        rnode = prefix_cache.search_best(ip_net)
+        if rnode is not None:
+            Cache_Set(asn_cache, ASNCache.Size, ip_net_u32, (int(rnode.data["asn"]), rnode.data["exp"]))
+
+
+def ASN_Cache_Invalidate(rnode):
+    # Drops the /24 networks of a prefix added to the prefix cache, cached entries may no longer be the best match.
+    if rnode.family != socket.AF_INET:
+        return
+
+    ip_net_u32 = NetFlowStructs.IPv4.unpack(socket.inet_aton(rnode.network))[0] & IP2ASN_def_mask.IPv4_Netmask
+    if rnode.prefixlen >= ASNCache.Prefixlen:
+        asn_cache.pop(ip_net_u32, None)
+        return
+
+    ip_net_nb = 1 << (ASNCache.Prefixlen - rnode.prefixlen)
+    if ip_net_nb <= len(asn_cache):
+        for i in range(ip_net_nb):
+            asn_cache.pop(ip_net_u32 + (i << (32 - ASNCache.Prefixlen)), None)
+
+    else:
+        ip_net_mask = (0xFFFFFFFF << (32 - rnode.prefixlen)) & 0xFFFFFFFF
+        for key in asn_cache.keys():
+            if key & ip_net_mask == ip_net_u32:
+                asn_cache.pop(key, None)
+
+
+def Prefix_Cache_Add(ip_prefix, asn, exp, report=True):
+    global prefix_cache, netflow_sources
+
+    # Returns True when the prefix was not in the prefix cache yet, only new prefixes are counted.
+    with lock:
+        prefix = prefix_cache.search_exact(ip_prefix)
+        prefix_new = prefix is None
+        if prefix_new:
+            prefix = prefix_cache.add(ip_prefix)
+            netflow_sources["stats_prefix_cache"] += 1
+        prefix.data["asn"] = asn
+        prefix.data["exp"] = exp
+        ASN_Cache_Invalidate(prefix)
+
+        if report and prefix_updates is not None:
+            prefix_updates[0].append((ip_prefix, asn, exp))
+
+    return prefix_new
+
+
+def Prefix_Cache_Expire(ip_prefix, ts):
+    global prefix_cache, netflow_sources
+
+    # Deletes the prefix when it has expired, the prefix may have been deleted or refreshed by another thread.
+    with lock:
+        prefix = prefix_cache.search_exact(ip_prefix)
+        if prefix is None or prefix.data["exp"] == 0 or prefix.data["exp"] >= ts:
+            return
+
+        prefix_cache.delete(ip_prefix)
+        netflow_sources["stats_prefix_cache"] -= 1
+
+        if prefix_updates is not None:
+            prefix_updates[1].append(ip_prefix)
+
+
+def IPv4_ntoa(ip_u32):
+    ip_str = ip4_cache.get(ip_u32)
+    if ip_str is None:
+        ip_str = socket.inet_ntoa(NetFlowStructs.IPv4.pack(ip_u32))
+        Cache_Set(ip4_cache, IPv4Cache.Size, ip_u32, ip_str)
+
+    return ip_str
+
+
+def Neg_Cache_Get(ip_net_key, ts):
+    # Returns True when the network is in the negative cache and has not expired yet.
+    with lock:
+        exp = neg_cache.pop(ip_net_key, None)
+        if exp is None or exp < ts:
+            return False
+
+        # Moved to the end, the least recently used network is evicted first.
+        neg_cache[ip_net_key] = exp
+        return True
+
+
+def Neg_Cache_Add(ip_net_key, exp):
+    with lock:
+        neg_cache.pop(ip_net_key, None)
+        neg_cache[ip_net_key] = exp
+        while len(neg_cache) > NegCache.Size:
+            neg_cache.popitem(last=False)
+
+
+def ASN_Lookup_Needed(asn):
+    # Missing, unknown and private ASNs are resolved with IP2ASN.
+    return asn is None or asn == ASNtype.Unknown or (asn >= 64512 and asn <= 65534) or (asn >= 4200000000 and asn <= 4294967294)
+
+
+def IP2ASN_dns_domain(ip_ver, ip2asn_mode):
+    if ip2asn_mode == "cymru":
+        if ip_ver == 4:
+            return ".origin.asn.cymru.com"
 
         else:
-            asn = ASNtype.Unknown
-            return asn
+            return ".origin6.asn.cymru.com"
 
+    elif ip2asn_mode == "routeviews":
         if ip_ver == 4:
-            ip_tmp = IPNetwork(ip_addr + "/" + IP2ASN_def_mask.IPv4).network
-            ip_net = str(ip_tmp)
-            ip_rev = ip_tmp.reverse_dns[0:-14]
+            return ".asn.routeviews.org"
 
         else:
-            ip_tmp = IPNetwork(ip_addr + "/" + IP2ASN_def_mask.IPv6).network
-            ip_net = str(ip_tmp)
-            ip_rev = ip_tmp.reverse_dns[0:-10]
+            # IPv6 addresses mapping is not supported by Route Views
+            return None
 
-        ts = int(time.time())
+    return None
+
+
+def IP2ASN_dns_query(ip_ver, ip_net_key):
+    # Reversed form of the network address (without .in-addr.arpa or .ip6.arpa), only built on a cache miss.
+    if ip_ver == 4:
+        return "%d.%d.%d.%d" % (ip_net_key & 0xFF, (ip_net_key >> 8) & 0xFF, (ip_net_key >> 16) & 0xFF, ip_net_key >> 24)
+
+    return "0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0." + ".".join(reversed(binascii.hexlify(ip_net_key)))
+
+
+def IP2ASN_dns_cache(ip_ver, ip_addr, ip_net_key, ts):
+    global prefix_cache, netflow_sources
+
+    # Returns the ASN from the ASN cache, the negative cache or the prefix cache, None when a DNS query is needed.
+    if ip_ver == 4:
+        asn = ASN_Cache_Get(ip_net_key, ts)
+        if asn is not None:
+            return asn
+
+    if neg_cache and Neg_Cache_Get(ip_net_key, ts):
+        return ASNtype.Unknown
+
+    rnode = prefix_cache.search_best(ip_addr)
+    while rnode is not None and rnode.data["exp"] != 0 and rnode.data["exp"] < ts:
+        Prefix_Cache_Expire(rnode.prefix, ts)
         rnode = prefix_cache.search_best(ip_addr)
-        if rnode is None:
-            qa = None
-            qac = 0
 
-            if ip2asn_mode == "cymru":
-                while ((qa is None or qa[3] == ()) and qac <= 1):
-                    with lock:
-                        netflow_sources["dns_queries"] += 1
-                    qa = adns_resolver.synchronous(ip_rev + ip2asn_domain, adns.rr.TXT)
-                    qac += 1
+    if rnode is None:
+        return None
 
-            elif ip2asn_mode == "routeviews":
-                while ((qa is None or qa[3] == ()) and qac <= 1):
-                    with lock:
-                        netflow_sources["dns_queries"] += 1
-                    qa = adns_resolver.synchronous(ip_rev + ip2asn_domain, adns.rr.TXT)
-                    qac += 1
+    if ip_ver == 4:
+        ASN_Cache_Add(ip_net_key, ts)
+    return int(rnode.data["asn"])
 
-            if ip2asn_mode == "cymru" and qa is not None and qa[3] != ():
-                for i in range(0, len(qa[3])):
-                    asn = int(qa[3][i][0].split("|")[0].split(" ")[0])
-                    ip_prefix = qa[3][i][0].split("|")[1].split(" ")[1]
 
-                    with lock:
-                        prefix = prefix_cache.add(ip_prefix)
-                        prefix.data["asn"] = asn
-                        prefix.data["exp"] = ts + PrefixExpire.Default
-                        netflow_sources["stats_prefix_cache"] += 1
+def IP2ASN_dns_answer(ip_ver, ip_net_key, ip2asn_mode, qa, ts):
+    global prefix_cache, netflow_sources
 
-                asn = int(prefix_cache.search_best(ip_addr).data["asn"])
+    # Adds prefixes from a DNS answer to the prefix cache.
+    # Returns the ASN of the whole network, None when it has to be looked up per IP address.
+    if ip2asn_mode == "cymru" and qa is not None and qa[3] != ():
+        # TXT record: "ASN [ASN ...] | prefix | CC | registry | date", the first ASN is used.
+        for rr in qa[3]:
+            asn, _, ip_prefix = rr[0].partition("|")
+            asn = int(asn.split(None, 1)[0])
+            ip_prefix = ip_prefix.split(None, 1)[0]
 
-            elif ip2asn_mode == "routeviews" and qa is not None and qa[3] != ():
-                asn = int(qa[3][0][0])
-                ip_prefix = qa[3][0][1] + "/" + qa[3][0][2]
+            Prefix_Cache_Add(ip_prefix, asn, ts + PrefixExpire.Default)
 
-                if ip_prefix != "0.0.0.0/0" and ip_prefix != "0/0":
-                    with lock:
-                        prefix = prefix_cache.add(ip_prefix)
-                        prefix.data["asn"] = asn
-                        prefix.data["exp"] = ts + PrefixExpire.Default
-                        netflow_sources["stats_prefix_cache"] += 1
+        return None
 
-                else:
-                    asn = ASNtype.Unknown
-                    with lock:
-                        prefix = prefix_cache.add(ip_net + "/" + IP2ASN_def_mask.IPv4)
-                        prefix.data["asn"] = asn
-                        prefix.data["exp"] = ts + PrefixExpire.Short
-                        netflow_sources["stats_prefix_cache"] += 1
+    elif ip2asn_mode == "routeviews" and qa is not None and qa[3] != ():
+        asn = int(qa[3][0][0])
+        ip_prefix = qa[3][0][1] + "/" + qa[3][0][2]
 
-            else:
-                asn = ASNtype.Unknown
+        if ip_prefix != "0.0.0.0/0" and ip_prefix != "0/0":
+            Prefix_Cache_Add(ip_prefix, asn, ts + PrefixExpire.Default)
 
-                with lock:
-                    if ip_ver == 4:
-                        prefix = prefix_cache.add(ip_net + "/" + IP2ASN_def_mask.IPv4)
+        else:
+            asn = ASNtype.Unknown
+            Neg_Cache_Add(ip_net_key, ts + PrefixExpire.Short)
 
-                    else:
-                        prefix = prefix_cache.add(ip_net + "/" + IP2ASN_def_mask.IPv6)
-                    prefix.data["asn"] = asn
-                    prefix.data["exp"] = ts + PrefixExpire.Short
-                    netflow_sources["stats_prefix_cache"] += 1
+        return asn
+
+    # Only prefixes from answers with data go to the prefix cache.
+    Neg_Cache_Add(ip_net_key, ts + PrefixExpire.Short)
+
+    return ASNtype.Unknown
+
+
+def IP2ASN_dns_resolve(adns_resolver, queries, ip2asn_mode, ts, asns):
+    global prefix_cache, netflow_sources
+
+    # Submits all queries at once and collects them afterwards, so their round trips overlap instead of adding up.
+    # Queries which returned no data are retried once, again all at once.
+    qac = 0
+    ip_queries = queries.keys()
+    while ip_queries and qac <= 1:
+        with lock:
+            netflow_sources["dns_queries"] += len(ip_queries)
+
+        adns_queries = []
+        for ip_query in ip_queries:
+            adns_queries.append((ip_query, adns_resolver.submit(ip_query, adns.rr.TXT)))
+
+        for ip_query, adns_query in adns_queries:
+            try:
+                queries[ip_query]["qa"] = adns_query.wait()
+            except:
+                queries[ip_query]["qa"] = None
+
+        ip_queries = [ip_query for ip_query in ip_queries if queries[ip_query]["qa"] is None or queries[ip_query]["qa"][3] == ()]
+        qac += 1
+
+    # Answers with data go first, a network without an answer may be covered by a prefix learnt from another answer.
+    for ip_query, query in sorted(queries.items(), key=lambda query: query[1]["qa"] is None or query[1]["qa"][3] == ()):
+        qa = query["qa"]
+        if (qa is None or qa[3] == ()) and prefix_cache.search_best(query["ip_addrs"][0]) is not None:
+            asn_net = None
 
         else:
-            if rnode.data["exp"] == 0 or rnode.data["exp"] >= ts:
-                asn = int(rnode.data["asn"])
+            asn_net = IP2ASN_dns_answer(query["ip_ver"], query["ip_net_key"], ip2asn_mode, qa, ts)
+
+        for ip_addr in query["ip_addrs"]:
+            if asn_net is not None:
+                asns[(query["ip_ver"], ip_addr)] = asn_net
+                continue
+
+            rnode = prefix_cache.search_best(ip_addr)
+            if rnode is None:
+                asns[(query["ip_ver"], ip_addr)] = ASNtype.Unknown
+                continue
+
+            asns[(query["ip_ver"], ip_addr)] = int(rnode.data["asn"])
+            if query["ip_ver"] == 4:
+                ASN_Cache_Add(query["ip_net_key"], ts)
+
+
+def IP2ASN_dns(adns_resolver, ip_list, ip2asn_mode):
+    global Running, prefix_cache, netflow_sources
+
+    # Resolves a list of (IP version, IP address) pairs, returns a dict (IP version, IP address) -> ASN.
+    # Cache misses are resolved in at most two rounds of overlapping DNS queries. The first round sends
+    # a single query per IPv4 /16 or IPv6 /32, the prefix in its answer often covers the other networks in it.
+    # Networks still missing from the cache after the first round are all queried in the second round.
+    asns = {}
+    ip_misses = []
+
+    try:
+        ts = int(time.time())
+        for ip_ver, ip_addr in ip_list:
+            ip2asn_domain = IP2ASN_dns_domain(ip_ver, ip2asn_mode)
+            if ip2asn_domain is None:
+                asns[(ip_ver, ip_addr)] = ASNtype.Unknown
+                continue
+
+            if ip_ver == 4:
+                ip_net_key = NetFlowStructs.IPv4.unpack(socket.inet_aton(ip_addr))[0] & IP2ASN_def_mask.IPv4_Netmask
 
             else:
-                with lock:
-                    prefix_cache.delete(rnode.prefix)
-                    netflow_sources["stats_prefix_cache"] -= 1
-                asn = IP2ASN_dns(adns_resolver, ip_ver, ip_addr, ip2asn_mode)
+                ip_net_key = socket.inet_pton(socket.AF_INET6, ip_addr)[0:6]
+
+            asn = IP2ASN_dns_cache(ip_ver, ip_addr, ip_net_key, ts)
+            if asn is not None:
+                asns[(ip_ver, ip_addr)] = asn
+                continue
+
+            ip_misses.append((ip_ver, ip_addr, ip_net_key, ip2asn_domain))
+
+        ip_round = 0
+        while ip_misses:
+            queries = {}
+            ip_groups = set()
+            ip_deferred = []
+            for ip_ver, ip_addr, ip_net_key, ip2asn_domain in ip_misses:
+                # Addresses from the same network share a single DNS query.
+                ip_query = IP2ASN_dns_query(ip_ver, ip_net_key) + ip2asn_domain
+                if ip_query in queries:
+                    queries[ip_query]["ip_addrs"].append(ip_addr)
+                    continue
+
+                if ip_ver == 4:
+                    ip_group = ip_net_key >> 16
+                else:
+                    ip_group = ip_net_key[0:4]
+                if ip_round == 0 and (ip_ver, ip_group) in ip_groups:
+                    ip_deferred.append((ip_ver, ip_addr, ip_net_key, ip2asn_domain))
+                    continue
+
+                ip_groups.add((ip_ver, ip_group))
+                queries[ip_query] = {"ip_ver": ip_ver, "ip_net_key": ip_net_key, "ip_addrs": [ip_addr], "qa": None}
+
+            IP2ASN_dns_resolve(adns_resolver, queries, ip2asn_mode, ts, asns)
+
+            ip_misses = []
+            for ip_ver, ip_addr, ip_net_key, ip2asn_domain in ip_deferred:
+                asn = IP2ASN_dns_cache(ip_ver, ip_addr, ip_net_key, ts)
+                if asn is not None:
+                    asns[(ip_ver, ip_addr)] = asn
+
+                else:
+                    ip_misses.append((ip_ver, ip_addr, ip_net_key, ip2asn_domain))
+            ip_round += 1
 
     except KeyboardInterrupt:
         Running = False
         os._exit(1)
 
-    except AttributeError:
-        if config["debug"]:
-            sys.stdout.write("I2A/%s/Exception: %s.\n" % (ip_addr, qa))
-            sys.stdout.flush()
-
-        asn = ASNtype.Unknown
-        return asn
-
     except:
         if config["debug"]:
             e = str(sys.exc_info())
-            sys.stdout.write("I2A/%s/Exception: %s, %s.\n" % (ip_addr, e, qa))
+            sys.stdout.write("I2A/%s/Exception: %s.\n" % (len(ip_list), e))
             sys.stdout.flush()
 
-        asn = ASNtype.Unknown
-        return asn
-
-    return asn
+    return asns
 
 
 def IP2ASN_geodb(ip_ver, ip_addr):
     global Running, prefix_cache
 
+    if ip_ver == 4:
+        ip_net_u32 = NetFlowStructs.IPv4.unpack(socket.inet_aton(ip_addr))[0] & IP2ASN_def_mask.IPv4_Netmask
+        asn = ASN_Cache_Get(ip_net_u32, 0)
+        if asn is not None:
+            return asn
+
     rnode = prefix_cache.search_best(ip_addr)
     if rnode is None:
         asn = ASNtype.Unknown
     else:
         asn = int(rnode.data["asn"])
+        if ip_ver == 4:
+            ASN_Cache_Add(ip_net_u32, 0)
 
     return asn
 
@@ -374,9 +675,23 @@ def HTTP_Worker():
     tornado.ioloop.IOLoop.instance().start()
 
 
+def SQLite_Connect():
+    # A single connection is kept open by the statistics worker and reused for every dump.
+    # Transactions are handled explicitly, sqlite3 would otherwise commit before every CREATE, DROP or ALTER statement.
+    sqlite_con = sqlite3.connect(config["db_file"], check_same_thread=False, isolation_level=None)
+    sqlite_con.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY;")
+    return sqlite_con
+
+
 def Stats_Worker():
     global Running, prefix_cache, netflow_sources
 
+    try:
+        sqlite_con = SQLite_Connect()
+
+    except sqlite3.Error:
+        sqlite_con = None
+
     swi = 1
     while Running:
         try:
@@ -388,16 +703,43 @@ def Stats_Worker():
                     if config["debug"]:
                         sys.stdout.write("SW/Dumping prefix table to SQLite database.\n")
                         sys.stdout.flush()
-                    sqlite_con = sqlite3.connect(config["db_file"])
+                    if sqlite_con is None:
+                        sqlite_con = SQLite_Connect()
                     sqlite_cur = sqlite_con.cursor()
-                    sqlite_cur.execute("DELETE FROM prefixes")
 
+                    # The snapshot is written to a new table which replaces the old one, all in a single transaction.
+                    # Readers see either the old or the new snapshot, and the old rows do not have to be deleted one by one.
+                    # Rows are inserted in chunks of SQLite_Dump.BatchSize to bound memory and to release the GIL between chunks.
                     nodes = prefix_cache.nodes()
-                    for rnode in nodes:
-                        sqlite_cur.execute("INSERT INTO prefixes VALUES ('" + rnode.prefix + "', " + str(rnode.data["asn"]) + ", " + str(rnode.data["exp"]) + ")")
-
-                    sqlite_con.commit()
-                    sqlite_con.close()
+                    rows = ((rnode.prefix, rnode.data["asn"], rnode.data["exp"]) for rnode in nodes)
+                    if sqlite3.sqlite_version_info >= (3, 7, 11):
+                        rows_multi = SQLite_Dump.RowsPerInsert
+                    else:
+                        rows_multi = 1
+                    sqlite_insert = "INSERT INTO prefixes_new VALUES " + ", ".join(["(?, ?, ?)"] * rows_multi)
+
+                    sqlite_cur.execute("BEGIN")
+                    try:
+                        sqlite_cur.execute("DROP TABLE IF EXISTS prefixes_new")
+                        sqlite_cur.execute("CREATE TABLE prefixes_new (prefix text, asn integer, timestamp integer)")
+                        while True:
+                            rows_chunk = list(islice(rows, SQLite_Dump.BatchSize))
+                            if not rows_chunk:
+                                break
+                            # Groups of rows_multi rows are flattened into one multi-row INSERT each, the remainder is inserted row by row.
+                            rows_full = len(rows_chunk) - len(rows_chunk) % rows_multi
+                            if rows_full:
+                                sqlite_cur.executemany(sqlite_insert, [tuple(chain.from_iterable(rows_chunk[i:i + rows_multi])) for i in range(0, rows_full, rows_multi)])
+                            if rows_full < len(rows_chunk):
+                                sqlite_cur.executemany("INSERT INTO prefixes_new VALUES (?, ?, ?)", rows_chunk[rows_full:])
+                            time.sleep(0)
+                        sqlite_cur.execute("DROP TABLE IF EXISTS prefixes")
+                        sqlite_cur.execute("ALTER TABLE prefixes_new RENAME TO prefixes")
+                        sqlite_cur.execute("COMMIT")
+
+                    except:
+                        sqlite_cur.execute("ROLLBACK")
+                        raise
 
                 else:
                     swi += 1
@@ -407,7 +749,7 @@ def Stats_Worker():
                         netflow_sources["stats_packets_processed"] = netflow_sources["v4_packets_processed"] + netflow_sources["v6_packets_processed"]
                         netflow_sources["stats_flows_received"] = netflow_sources["flows_received"]
                         netflow_sources["stats_flows_processed"] = netflow_sources["flows_processed"]
-                        netflow_sources["stats_queue"] = netflow_queue.qsize()
+                        netflow_sources["stats_queue"] = netflow_queue.qsize_packets()
                         netflow_sources["stats_dns_queries"] = netflow_sources["dns_queries"]
                         netflow_sources["v4_packets_received"] = 0
                         netflow_sources["v6_packets_received"] = 0
@@ -448,6 +790,19 @@ def Stats_Worker():
             Running = False
             os._exit(1)
 
+        except sqlite3.Error:
+            if config["debug"]:
+                e = str(sys.exc_info())
+                sys.stdout.write("SW/SQLite exception: %s.\n" % (e))
+                sys.stdout.flush()
+
+            # Reopened on the next dump.
+            try:
+                sqlite_con.close()
+            except:
+                pass
+            sqlite_con = None
+
         except:
             if config["debug"]:
                 e = str(sys.exc_info())
@@ -456,22 +811,38 @@ def Stats_Worker():
             pass
 
 
+def NetFlow_Forward_Init():
+    global fwd_sock, fwd_addr
+
+    fwd_family, fwd_type, fwd_proto, fwd_name, fwd_addr = socket.getaddrinfo(config["forwardto_ip"], config["forwardto_port"], 0, socket.SOCK_DGRAM)[0]
+    fwd_sock = socket.socket(fwd_family, socket.SOCK_DGRAM)
+    fwd_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config["forwardto_sndbuf"])
+
+
 def NetFlow_Worker():
     global Running
 
+    CPU_Affinity(CPU_Workers())
+    forward = fwd_sock is not None
+
     if config["ip2asn_enable"] and (config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews"):
         adns_resolver = adns.init()
 
+    else:
+        adns_resolver = 0
+    flow_processor = NetFlow_FlowProcessorInit(adns_resolver)
+
     while Running:
         try:
             while Running:
-                nf_src_ip, data = netflow_queue.get(block=True, timeout=10)
-                if config["ip2asn_enable"] and (config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews"):
-                    NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data)
-
-                else:
-                    NetFlow_PacketProcessor(0, nf_src_ip, data)
-                netflow_queue.task_done()
+                packets = netflow_queue.get(block=True, timeout=10)
+                for nf_src_ip, data in packets:
+                    if forward:
+                        try:
+                            fwd_sock.sendto(data, fwd_addr)
+                        except socket.error:
+                            pass
+                    NetFlow_PacketProcessor(flow_processor, nf_src_ip, data)
 
         except Queue.Empty:
             if config["debug"]:
@@ -491,18 +862,212 @@ def NetFlow_Worker():
             pass
 
 
+def NetFlow_Queue_Size():
+    # netflow_queue is set in packets, the queue holds batches of up to flow_recv_batch packets.
+    return max(1, config["netflow_queue"] // config["flow_recv_batch"])
+
+
+def NetFlow_Processes():
+    netflow_processes = config["netflow_processes"]
+    if netflow_processes is None:
+        try:
+            netflow_processes = multiprocessing.cpu_count() - 1
+
+        except NotImplementedError:
+            netflow_processes = 0
+
+    return max(netflow_processes, 0)
+
+
+def NetFlow_Process(process_id, packet_queue, report_queue):
+    global Running, lock, netflow_queue, netflow_sources, prefix_updates, process_packets_taken
+
+    # Runs in a forked NetFlow worker process. The prefix cache is inherited from the main process,
+    # the lock, the queue, and the counters (reported as deltas) are private to this process.
+    # The local queue only hands batches over to the NetFlow workers, packets wait in the process queue.
+    Running = True
+    lock = threading.RLock()
+    netflow_queue = RingQueue(maxsize=config["netflow_workers"])
+    prefix_updates = ([], [])
+    parent_pid = os.getppid()
+
+    for key in NetFlowProcess.Counters:
+        netflow_sources[key] = 0
+    for src_stats in netflow_sources.values():
+        if isinstance(src_stats, dict):
+            for key in NetFlowProcess.SourceCounters:
+                if key in src_stats:
+                    src_stats[key] = 0
+
+    for i in range(config["netflow_workers"]):
+        netflowd = threading.Thread(target=NetFlow_Worker)
+        netflowd.daemon = True
+        netflowd.start()
+
+    reportd = threading.Thread(target=NetFlow_Process_Report, args=(process_id, report_queue))
+    reportd.daemon = True
+    reportd.start()
+
+    while Running:
+        try:
+            while Running:
+                try:
+                    packets = packet_queue.get(block=True, timeout=10)
+
+                except Queue.Empty:
+                    # The main process is gone.
+                    if os.getppid() != parent_pid:
+                        Running = False
+                        os._exit(0)
+                    continue
+
+                # Prefixes learnt by other NetFlow worker processes.
+                if isinstance(packets, tuple):
+                    for ip_prefix, asn, exp in packets[1]:
+                        Prefix_Cache_Add(ip_prefix, asn, exp, report=False)
+                    continue
+
+                with lock:
+                    process_packets_taken += len(packets)
+                    for ipaddr, data in packets:
+                        if ipaddr not in netflow_sources:
+                            netflow_sources[ipaddr] = {}
+                            if ":" in ipaddr:
+                                netflow_sources[ipaddr]["v6_packets_received"] = 0
+                                netflow_sources[ipaddr]["v6_packets_processed"] = 0
+                            else:
+                                netflow_sources[ipaddr]["v4_packets_received"] = 0
+                                netflow_sources[ipaddr]["v4_packets_processed"] = 0
+
+                # Waits for the NetFlow workers, the process queue fills up and drops packets instead.
+                while True:
+                    try:
+                        netflow_queue.put(packets, block=False)
+                        break
+                    except Queue.Full:
+                        time.sleep(0.001)
+
+        except KeyboardInterrupt:
+            Running = False
+            os._exit(1)
+
+        except:
+            if config["debug"]:
+                e = str(sys.exc_info())
+                sys.stdout.write("NFP/Exception: %s.\n" % (e))
+                sys.stdout.flush()
+            pass
+
+
+def NetFlow_Process_Report(process_id, report_queue):
+    global Running, netflow_sources, process_packets_taken
+
+    # Sends the counters, the queue depth and the prefixes learnt or expired since the last report to the main process.
+    while Running:
+        try:
+            time.sleep(NetFlowProcess.ReportInterval)
+
+            counters = {}
+            sources = {}
+            with lock:
+                for key in NetFlowProcess.Counters:
+                    counters[key] = netflow_sources[key]
+                    netflow_sources[key] = 0
+
+                for src, src_stats in netflow_sources.items():
+                    if isinstance(src_stats, dict):
+                        for key in NetFlowProcess.SourceCounters:
+                            if src_stats.get(key):
+                                sources.setdefault(src, {})[key] = src_stats[key]
+                                src_stats[key] = 0
+
+                prefixes_added = prefix_updates[0][:]
+                prefixes_expired = prefix_updates[1][:]
+                del prefix_updates[0][:]
+                del prefix_updates[1][:]
+
+                packets_taken = process_packets_taken
+                process_packets_taken = 0
+            packets_local = netflow_queue.qsize_packets()
+
+            report_queue.put((process_id, counters, sources, prefixes_added, prefixes_expired, packets_taken, packets_local))
+
+        except KeyboardInterrupt:
+            Running = False
+            os._exit(1)
+
+        except:
+            if config["debug"]:
+                e = str(sys.exc_info())
+                sys.stdout.write("NFP/Report exception: %s.\n" % (e))
+                sys.stdout.flush()
+            pass
+
+
+def NetFlow_Process_Stats(report_queue):
+    global Running, netflow_sources
+
+    # Merges reports of NetFlow worker processes, the main process keeps the prefix cache dumped to SQLite.
+    # Prefixes new to the main process are sent to the other NetFlow worker processes, which then do not query them again.
+    while Running:
+        try:
+            process_id, counters, sources, prefixes_added, prefixes_expired, packets_taken, packets_local = report_queue.get(block=True, timeout=10)
+            netflow_queue.process_report(process_id, packets_taken, packets_local)
+
+            with lock:
+                for key, value in counters.items():
+                    netflow_sources[key] += value
+
+                for src, src_stats in sources.items():
+                    if src in netflow_sources:
+                        for key, value in src_stats.items():
+                            netflow_sources[src][key] = netflow_sources[src].get(key, 0) + value
+
+            prefixes_new = []
+            for ip_prefix, asn, exp in prefixes_added:
+                if Prefix_Cache_Add(ip_prefix, asn, exp):
+                    prefixes_new.append((ip_prefix, asn, exp))
+
+            ts = int(time.time())
+            for ip_prefix in prefixes_expired:
+                Prefix_Cache_Expire(ip_prefix, ts)
+
+            if prefixes_new:
+                netflow_queue.broadcast(("prefixes", prefixes_new), process_id)
+
+        except Queue.Empty:
+            pass
+
+        except KeyboardInterrupt:
+            Running = False
+            os._exit(1)
+
+        except:
+            if config["debug"]:
+                e = str(sys.exc_info())
+                sys.stdout.write("NFS/Exception: %s.\n" % (e))
+                sys.stdout.flush()
+            pass
+
+
 def NetFlow_Receiver(netrecvd):
     global Running, netflow_sources
 
     if netrecvd == "ipv4":
-        flow_ipv4 = (config["flow_ipv4"], config["flow_port"])
-        UDPSockv4 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        UDPSockv4.bind(flow_ipv4)
+        flow_ip = (config["flow_ipv4"], config["flow_port"])
+        UDPSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        UDPSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config["flow_rcvbuf"])
+        UDPSock.bind(flow_ip)
+        stats_received = "v4_packets_received"
+        stats_processed = "v4_packets_processed"
 
     elif netrecvd == "ipv6":
-        flow_ipv6 = (config["flow_ipv6"], config["flow_port"])
-        UDPSockv6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-        UDPSockv6.bind(flow_ipv6)
+        flow_ip = (config["flow_ipv6"], config["flow_port"])
+        UDPSock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        UDPSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config["flow_rcvbuf"])
+        UDPSock.bind(flow_ip)
+        stats_received = "v6_packets_received"
+        stats_processed = "v6_packets_processed"
 
     else:
         if config["debug"]:
@@ -511,61 +1076,41 @@ def NetFlow_Receiver(netrecvd):
         Running = False
         return
 
-    while Running:
-        try:
-            if netrecvd == "ipv4":
-                while Running:
-                    data, ipaddr = UDPSockv4.recvfrom(8192)
-                    netflow_queue.put([ipaddr[0], data], block=False)
+    # A dedicated CPU keeps the receiver from being descheduled by NetFlow workers.
+    CPU_Affinity(CPU_Receivers())
 
-                    with lock:
-                        netflow_sources["v4_packets_received"] += 1
-                        if ipaddr[0] in netflow_sources.keys():
-                            netflow_sources[ipaddr[0]]["v4_packets_received"] += 1
+    # Linux doubles the requested value and caps it at net.core.rmem_max.
+    if config["debug"]:
+        sys.stdout.write("NFR/NetFlow receiver %s socket receive buffer: %s bytes.\n" % (netrecvd, UDPSock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+        sys.stdout.flush()
 
-                        else:
-                            netflow_sources[ipaddr[0]] = {}
-                            netflow_sources[ipaddr[0]]["v4_packets_received"] = 1
-                            netflow_sources[ipaddr[0]]["v4_packets_processed"] = 0
+    # Packets are received and queued in batches, up to flow_recv_batch packets per recvmmsg() call.
+    netflow_recv = RecvInit(UDPSock, config["flow_recv_batch"], 8192)
+    if config["debug"]:
+        sys.stdout.write("NFR/NetFlow receiver %s uses %s.\n" % (netrecvd, netflow_recv.__class__.__name__))
+        sys.stdout.flush()
 
-            else:
-                while Running:
-                    data, ipaddr = UDPSockv6.recvfrom(8192)
-                    netflow_queue.put([ipaddr[0], data], block=False)
-
-                    with lock:
-                        netflow_sources["v6_packets_received"] += 1
-                        if ipaddr[0] in netflow_sources.keys():
-                            netflow_sources[ipaddr[0]]["v6_packets_received"] += 1
-
-                        else:
-                            netflow_sources[ipaddr[0]] = {}
-                            netflow_sources[ipaddr[0]]["v6_packets_received"] = 1
-                            netflow_sources[ipaddr[0]]["v6_packets_processed"] = 0
+    while Running:
+        try:
+            while Running:
+                packets = netflow_recv.recv()
+                if not packets:
+                    continue
 
-        except Queue.Full:
-            if netrecvd == "ipv4":
                 with lock:
-                    netflow_sources["v4_packets_received"] += 1
-                    if ipaddr[0] in netflow_sources.keys():
-                        netflow_sources[ipaddr[0]]["v4_packets_received"] += 1
-
-                    else:
-                        netflow_sources[ipaddr[0]] = {}
-                        netflow_sources[ipaddr[0]]["v4_packets_received"] = 1
-                        netflow_sources[ipaddr[0]]["v4_packets_processed"] = 0
+                    netflow_sources[stats_received] += len(packets)
+                    for ipaddr, data in packets:
+                        if ipaddr in netflow_sources.keys():
+                            netflow_sources[ipaddr][stats_received] += 1
 
-            else:
-                with lock:
-                    netflow_sources["v6_packets_received"] += 1
-                    if ipaddr[0] in netflow_sources.keys():
-                        netflow_sources[ipaddr[0]]["v6_packets_received"] += 1
+                        else:
+                            netflow_sources[ipaddr] = {}
+                            netflow_sources[ipaddr][stats_received] = 1
+                            netflow_sources[ipaddr][stats_processed] = 0
 
-                    else:
-                        netflow_sources[ipaddr[0]] = {}
-                        netflow_sources[ipaddr[0]]["v6_packets_received"] = 1
-                        netflow_sources[ipaddr[0]]["v6_packets_processed"] = 0
+                netflow_queue.put(packets, block=False)
 
+        except Queue.Full:
             if config["debug"]:
                 sys.stdout.write("NFR/Flow queue is full.\n")
                 sys.stdout.flush()
@@ -587,63 +1132,88 @@ def NetFlow_Receiver(netrecvd):
             pass
 
 
-def NetFlow_FlowProcessor(adns_resolver, nfd):
+def NetFlow_FlowProcessorInit(adns_resolver):
     global Running, netflow_sources
 
-    if config["ip2asn_enable"]:
-        if nfd["src_ip4"] is not None and nfd["dst_ip4"] is not None:
-            if nfd["src_as"] is None or nfd["src_as"] == ASNtype.Unknown or (nfd["src_as"] >= 64512 and nfd["src_as"] <= 65534) or (nfd["src_as"] >= 4200000000 and nfd["src_as"] <= 4294967294):
-                if config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews":
-                    nfd["src_as"] = IP2ASN_dns(adns_resolver, 4, nfd["src_ip4"], config["ip2asn_mode"])
-                elif config["ip2asn_mode"] == "maxmind":
-                    nfd["src_as"] = IP2ASN_geodb(4, nfd["src_ip4"])
-
-            if nfd["dst_as"] is None or nfd["dst_as"] == ASNtype.Unknown or (nfd["dst_as"] >= 64512 and nfd["dst_as"] <= 65534) or (nfd["dst_as"] >= 4200000000 and nfd["dst_as"] <= 4294967294):
-                if config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews":
-                    nfd["dst_as"] = IP2ASN_dns(adns_resolver, 4, nfd["dst_ip4"], config["ip2asn_mode"])
-                elif config["ip2asn_mode"] == "maxmind":
-                    nfd["dst_as"] = IP2ASN_geodb(4, nfd["dst_ip4"])
-
-        elif nfd["src_ip6"] is not None and nfd["dst_ip6"] is not None:
-            if nfd["src_as"] is None or nfd["src_as"] == ASNtype.Unknown or (nfd["src_as"] >= 64512 and nfd["src_as"] <= 65534) or (nfd["src_as"] >= 4200000000 and nfd["src_as"] <= 4294967294):
-                if config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews":
-                    nfd["src_as"] = IP2ASN_dns(adns_resolver, 6, nfd["src_ip6"], config["ip2asn_mode"])
-                elif config["ip2asn_mode"] == "maxmind":
-                    nfd["src_as"] = IP2ASN_geodb(6, nfd["src_ip6"])
-
-            if nfd["dst_as"] is None or nfd["dst_as"] == ASNtype.Unknown or (nfd["dst_as"] >= 64512 and nfd["dst_as"] <= 65534) or (nfd["dst_as"] >= 4200000000 and nfd["dst_as"] <= 4294967294):
-                if config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews":
-                    nfd["dst_as"] = IP2ASN_dns(adns_resolver, 6, nfd["dst_ip6"], config["ip2asn_mode"])
-                elif config["ip2asn_mode"] == "maxmind":
-                    nfd["dst_as"] = IP2ASN_geodb(6, nfd["dst_ip6"])
-
-    # if config["debug"]:
-    #    if nfd["in_packets"] > 10000 or nfd["out_packets"] > 10000:
-    #        if nfd["src_ip4"] is not None and nfd["dst_ip4"] is not None:
-    #            sys.stdout.write("NFP/%s/%s/%s/%s/%s/%s/%s/%s.\n" % (nfd["msg_src_ip"], nfd["src_ip4"], nfd["dst_ip4"], nfd["proto"], nfd["in_bytes"], nfd["in_packets"], nfd["out_bytes"], nfd["out_packets"]))
-    #        else:
-    #            sys.stdout.write("NFP/%s/%s/%s/%s/%s/%s/%s/%s.\n" % (nfd["msg_src_ip"], nfd["src_ip6"], nfd["dst_ip6"], nfd["proto"], nfd["in_bytes"], nfd["in_packets"], nfd["out_bytes"], nfd["out_packets"]))
-    #        sys.stdout.flush()
+    # IP2ASN settings are resolved once per worker, the returned flow processor does not check them per flow.
+    # The flow processor gets all flows of a packet and resolves their ASNs with a single IP2ASN call.
+    if config["ip2asn_enable"] and (config["ip2asn_mode"] == "cymru" or config["ip2asn_mode"] == "routeviews"):
+        ip2asn_mode = config["ip2asn_mode"]
 
-    with lock:
-        if nfd["proto"] == Protocols.TCP:
-            netflow_sources["proto_tcp_bytes"] += nfd["in_bytes"]
-            netflow_sources["proto_tcp_packets"] += nfd["in_packets"]
-        elif nfd["proto"] == Protocols.UDP:
-            netflow_sources["proto_udp_bytes"] += nfd["in_bytes"]
-            netflow_sources["proto_udp_packets"] += nfd["in_packets"]
-        elif nfd["proto"] == Protocols.ICMP:
-            netflow_sources["proto_icmp_bytes"] += nfd["in_bytes"]
-            netflow_sources["proto_icmp_packets"] += nfd["in_packets"]
-        elif nfd["proto"] == Protocols.IPV6 or nfd["proto"] == Protocols.ICMP6:
-            netflow_sources["proto_ipv6_bytes"] += nfd["in_bytes"]
-            netflow_sources["proto_ipv6_packets"] += nfd["in_packets"]
-        else:
-            netflow_sources["proto_other_bytes"] += nfd["in_bytes"]
-            netflow_sources["proto_other_packets"] += nfd["in_packets"]
+        def IP2ASN(ip_list):
+            return IP2ASN_dns(adns_resolver, ip_list, ip2asn_mode)
+
+    elif config["ip2asn_enable"] and config["ip2asn_mode"] == "maxmind":
+        def IP2ASN(ip_list):
+            asns = {}
+            for ip_ver, ip_addr in ip_list:
+                asns[(ip_ver, ip_addr)] = IP2ASN_geodb(ip_ver, ip_addr)
+            return asns
+
+    else:
+        IP2ASN = None
+
+    def NetFlow_FlowStats(nfds):
+        # if config["debug"]:
+        #    if nfd["in_packets"] > 10000 or nfd["out_packets"] > 10000:
+        #        if nfd["src_ip4"] is not None and nfd["dst_ip4"] is not None:
+        #            sys.stdout.write("NFP/%s/%s/%s/%s/%s/%s/%s/%s.\n" % (nfd["msg_src_ip"], nfd["src_ip4"], nfd["dst_ip4"], nfd["proto"], nfd["in_bytes"], nfd["in_packets"], nfd["out_bytes"], nfd["out_packets"]))
+        #        else:
+        #            sys.stdout.write("NFP/%s/%s/%s/%s/%s/%s/%s/%s.\n" % (nfd["msg_src_ip"], nfd["src_ip6"], nfd["dst_ip6"], nfd["proto"], nfd["in_bytes"], nfd["in_packets"], nfd["out_bytes"], nfd["out_packets"]))
+        #        sys.stdout.flush()
+
+        with lock:
+            for nfd in nfds:
+                if nfd["proto"] == Protocols.TCP:
+                    netflow_sources["proto_tcp_bytes"] += nfd["in_bytes"]
+                    netflow_sources["proto_tcp_packets"] += nfd["in_packets"]
+                elif nfd["proto"] == Protocols.UDP:
+                    netflow_sources["proto_udp_bytes"] += nfd["in_bytes"]
+                    netflow_sources["proto_udp_packets"] += nfd["in_packets"]
+                elif nfd["proto"] == Protocols.ICMP:
+                    netflow_sources["proto_icmp_bytes"] += nfd["in_bytes"]
+                    netflow_sources["proto_icmp_packets"] += nfd["in_packets"]
+                elif nfd["proto"] == Protocols.IPV6 or nfd["proto"] == Protocols.ICMP6:
+                    netflow_sources["proto_ipv6_bytes"] += nfd["in_bytes"]
+                    netflow_sources["proto_ipv6_packets"] += nfd["in_packets"]
+                else:
+                    netflow_sources["proto_other_bytes"] += nfd["in_bytes"]
+                    netflow_sources["proto_other_packets"] += nfd["in_packets"]
+
+            netflow_sources["flows_processed"] += len(nfds)
+
+    if IP2ASN is None:
+        return NetFlow_FlowStats
+
+    def NetFlow_FlowProcessor(nfds):
+        # (flow, key, IP version, IP address) for every ASN which has to be resolved.
+        nfd_lookups = []
+        for nfd in nfds:
+            if nfd["src_ip4"] is not None and nfd["dst_ip4"] is not None:
+                if ASN_Lookup_Needed(nfd["src_as"]):
+                    nfd_lookups.append((nfd, "src_as", 4, nfd["src_ip4"]))
+
+                if ASN_Lookup_Needed(nfd["dst_as"]):
+                    nfd_lookups.append((nfd, "dst_as", 4, nfd["dst_ip4"]))
 
+            elif nfd["src_ip6"] is not None and nfd["dst_ip6"] is not None:
+                if ASN_Lookup_Needed(nfd["src_as"]):
+                    nfd_lookups.append((nfd, "src_as", 6, nfd["src_ip6"]))
 
-def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
+                if ASN_Lookup_Needed(nfd["dst_as"]):
+                    nfd_lookups.append((nfd, "dst_as", 6, nfd["dst_ip6"]))
+
+        if nfd_lookups:
+            asns = IP2ASN(set([(ip_ver, ip_addr) for nfd, nfd_key, ip_ver, ip_addr in nfd_lookups]))
+            for nfd, nfd_key, ip_ver, ip_addr in nfd_lookups:
+                nfd[nfd_key] = asns.get((ip_ver, ip_addr), ASNtype.Unknown)
+
+        NetFlow_FlowStats(nfds)
+
+    return NetFlow_FlowProcessor
+
+
+def NetFlow_PacketProcessor(flow_processor, nf_src_ip, data):
     global Running, netflow_sources
 
     try:
@@ -653,9 +1223,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
         nfd["msg_src_ip"] = nf_src_ip
 
         nfdec_pos = 0
-        nfdec_size = 2
+        nfdec_size = NetFlowStructs.Version.size
         # Bits 0..15 - Version
-        nfd["version"], = struct.unpack(">H", data[nfdec_pos:nfdec_pos + nfdec_size])
+        nfd["version"], = NetFlowStructs.Version.unpack_from(data, nfdec_pos)
         nfdec_pos += nfdec_size
 
         if nfd["version"] == 1:
@@ -664,9 +1234,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
             # I/Bits  32...63 - System Uptime
             # I/Bits  64...95 - UNIX seconds
             # I/Bits  96..127 - UNIX nano seconds
-            nfdec_size = 14
+            nfdec_size = NetFlowStructs.V1_Header.size
             if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["unix_nsec"] = struct.unpack(">HIII", data[nfdec_pos:nfdec_pos + nfdec_size])
+                nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["unix_nsec"] = NetFlowStructs.V1_Header.unpack_from(data, nfdec_pos)
                 nfdec_pos += nfdec_size
 
             else:
@@ -676,31 +1246,33 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                 return
 
             # Data
+            nfd_flows = []
             i = 0
             while i != nfd["count"]:
                 with lock:
                     netflow_sources["flows_received"] += 1
 
-                nfdec_size = 48
+                nfdec_size = NetFlowStructs.V1_Record.size
                 if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                    nfd_src_ip4, nfd_dst_ip4, nfd_nexthop_ip4, nfd["in_interface"], nfd["out_interface"], nfd["in_packets"], nfd["in_bytes"], nfd["flow_first"], nfd["flow_last"], nfd["src_port"], nfd["dst_port"], nf_pad1, nfd["proto"], nfd["src_tos"], nfd["tcp_flags"], nf_pad2, nf_pad3, nf_pad4, nf_reserved = struct.unpack(">IIIHHIIIIHHHBBBBBBI", data[nfdec_pos:nfdec_pos + nfdec_size])
+                    nfd_src_ip4, nfd_dst_ip4, nfd_nexthop_ip4, nfd["in_interface"], nfd["out_interface"], nfd["in_packets"], nfd["in_bytes"], nfd["flow_first"], nfd["flow_last"], nfd["src_port"], nfd["dst_port"], nf_pad1, nfd["proto"], nfd["src_tos"], nfd["tcp_flags"], nf_pad2, nf_pad3, nf_pad4, nf_reserved = NetFlowStructs.V1_Record.unpack_from(data, nfdec_pos)
                     nfdec_pos += nfdec_size
                     i += 1
 
-                    nfd["src_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_src_ip4))
-                    nfd["dst_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_dst_ip4))
-                    nfd["nexthop_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_nexthop_ip4))
+                    nfd["src_ip4"] = IPv4_ntoa(nfd_src_ip4)
+                    nfd["dst_ip4"] = IPv4_ntoa(nfd_dst_ip4)
+                    nfd["nexthop_ip4"] = IPv4_ntoa(nfd_nexthop_ip4)
 
                 else:
                     if config["debug"]:
                         sys.stdout.write("NPP/%s/v%s/%s/Not enough data left.\n" % (nfd["msg_src_ip"], nfd["version"], nfd["msg_type"]))
                         sys.stdout.flush()
+                    flow_processor(nfd_flows)
                     return
 
-                NetFlow_FlowProcessor(adns_resolver, nfd)
+                nfd_flows.append(dict(nfd))
 
-                with lock:
-                    netflow_sources["flows_processed"] += 1
+            # Flows of the whole packet are processed at once.
+            flow_processor(nfd_flows)
 
             with lock:
                 if "." in nfd["msg_src_ip"]:
@@ -720,9 +1292,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
             # B/Bits 160..167 - Engine Type
             # B/Bits 168..175 - Engine ID
             # H/Bits 176..191 - Sampling Interval
-            nfdec_size = 22
+            nfdec_size = NetFlowStructs.V5_Header.size
             if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["unix_nsec"], nfd["sequence_number"], nfd["engine_type"], nfd["engine_id"], nfd["sampling_interval"] = struct.unpack(">HIIIIBBH", data[nfdec_pos:nfdec_pos + nfdec_size])
+                nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["unix_nsec"], nfd["sequence_number"], nfd["engine_type"], nfd["engine_id"], nfd["sampling_interval"] = NetFlowStructs.V5_Header.unpack_from(data, nfdec_pos)
                 nfdec_pos += nfdec_size
 
             else:
@@ -732,31 +1304,33 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                 return
 
             # Data
+            nfd_flows = []
             i = 0
             while i != nfd["count"]:
                 with lock:
                     netflow_sources["flows_received"] += 1
 
-                nfdec_size = 48
+                nfdec_size = NetFlowStructs.V5_Record.size
                 if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                    nfd_src_ip4, nfd_dst_ip4, nfd_nexthop_ip4, nfd["in_interface"], nfd["out_interface"], nfd["in_packets"], nfd["in_bytes"], nfd["flow_first"], nfd["flow_last"], nfd["src_port"], nfd["dst_port"], nf_pad1, nfd["tcp_flags"], nfd["proto"], nfd["src_tos"], nfd["src_as"], nfd["dst_as"], nfd["src_mask4"], nfd["dst_mask4"], nf_pad2 = struct.unpack(">IIIHHIIIIHHBBBBHHBBH", data[nfdec_pos:nfdec_pos + nfdec_size])
+                    nfd_src_ip4, nfd_dst_ip4, nfd_nexthop_ip4, nfd["in_interface"], nfd["out_interface"], nfd["in_packets"], nfd["in_bytes"], nfd["flow_first"], nfd["flow_last"], nfd["src_port"], nfd["dst_port"], nf_pad1, nfd["tcp_flags"], nfd["proto"], nfd["src_tos"], nfd["src_as"], nfd["dst_as"], nfd["src_mask4"], nfd["dst_mask4"], nf_pad2 = NetFlowStructs.V5_Record.unpack_from(data, nfdec_pos)
                     nfdec_pos += nfdec_size
                     i += 1
 
-                    nfd["src_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_src_ip4))
-                    nfd["dst_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_dst_ip4))
-                    nfd["nexthop_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nfd_nexthop_ip4))
+                    nfd["src_ip4"] = IPv4_ntoa(nfd_src_ip4)
+                    nfd["dst_ip4"] = IPv4_ntoa(nfd_dst_ip4)
+                    nfd["nexthop_ip4"] = IPv4_ntoa(nfd_nexthop_ip4)
 
                 else:
                     if config["debug"]:
                         sys.stdout.write("NPP/%s/v%s/%s/Not enough data left.\n" % (nfd["msg_src_ip"], nfd["version"], nfd["msg_type"]))
                         sys.stdout.flush()
+                    flow_processor(nfd_flows)
                     return
 
-                NetFlow_FlowProcessor(adns_resolver, nfd)
+                nfd_flows.append(dict(nfd))
 
-                with lock:
-                    netflow_sources["flows_processed"] += 1
+            # Flows of the whole packet are processed at once.
+            flow_processor(nfd_flows)
 
             with lock:
                 if "." in nfd["msg_src_ip"]:
@@ -776,9 +1350,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                 # I/Bits 128..159 - Source ID
                 # H/Bits 160..175 - Element ID
                 # H/Bits 176..191 - Field Length
-                nfdec_size = 22
+                nfdec_size = NetFlowStructs.V9_Header.size
                 if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                    nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["sequence_number"], nfd["source_id"], nfd["field_info_element_id"], nfd["field_length"] = struct.unpack(">HIIIIHH", data[nfdec_pos:nfdec_pos + nfdec_size])
+                    nfd["count"], nfd["sys_uptime"], nfd["unix_sec"], nfd["sequence_number"], nfd["source_id"], nfd["field_info_element_id"], nfd["field_length"] = NetFlowStructs.V9_Header.unpack_from(data, nfdec_pos)
                     nfdec_pos += nfdec_size
                     nfd["domain_id"] = 0
 
@@ -796,9 +1370,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                 # I/Bits  96..127 - Observation Domain ID
                 # H/Bits 128..143 - Element ID
                 # H/Bits 144..159 - Field Length
-                nfdec_size = 18
+                nfdec_size = NetFlowStructs.V10_Header.size
                 if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                    nfd["length"], nfd["export_time"], nfd["sequence_number"], nfd["domain_id"], nfd["field_info_element_id"], nfd["field_length"] = struct.unpack(">HIIIHH", data[nfdec_pos:nfdec_pos + nfdec_size])
+                    nfd["length"], nfd["export_time"], nfd["sequence_number"], nfd["domain_id"], nfd["field_info_element_id"], nfd["field_length"] = NetFlowStructs.V10_Header.unpack_from(data, nfdec_pos)
                     nfdec_pos += nfdec_size
 
                 else:
@@ -809,9 +1383,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
 
                 # Bits 160..191 - Enterprise Number (when 1st bit in Element ID is set)
                 if nfd["field_info_element_id"] & NetflowMessageID.Enterprise == NetflowMessageID.Enterprise:
-                    nfdec_size = 4
+                    nfdec_size = NetFlowStructs.Enterprise.size
                     if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                        nfd["enterprise_number"], = struct.unpack(">I", data[nfdec_pos:nfdec_pos + nfdec_size])
+                        nfd["enterprise_number"], = NetFlowStructs.Enterprise.unpack_from(data, nfdec_pos)
                         nfdec_pos += nfdec_size
 
                     else:
@@ -831,9 +1405,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
 
                 # while nfdec_pos != nfd["msg_size"]:
                 while nfdec_pos != nf_template_size:
-                    nfdec_size = 4
+                    nfdec_size = NetFlowStructs.Template_Header.size
                     if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                        nfd["template_id"], nfd["template_field_count"] = struct.unpack(">HH", data[nfdec_pos:nfdec_pos + nfdec_size])
+                        nfd["template_id"], nfd["template_field_count"] = NetFlowStructs.Template_Header.unpack_from(data, nfdec_pos)
                         nfdec_pos += nfdec_size
 
                     else:
@@ -844,7 +1418,10 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
 
                     nfdec_size = nfd["template_field_count"] * 4
                     if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                        nfd_template = struct.unpack(">" + "H" * (nfdec_size / 2), data[nfdec_pos:nfdec_pos + nfdec_size])
+                        # Pairs of (field type, field length), big-endian unsigned shorts.
+                        nfd_template = array.array("H", data[nfdec_pos:nfdec_pos + nfdec_size])
+                        if sys.byteorder == "little":
+                            nfd_template.byteswap()
                         nfdec_pos += nfdec_size
 
                     else:
@@ -854,9 +1431,9 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                         return
 
                     if (nfd["version"] == 10) and (nfd["field_info_element_id"] & NetflowMessageID.Enterprise == NetflowMessageID.Enterprise):
-                        nfdec_size = 4
+                        nfdec_size = NetFlowStructs.Enterprise.size
                         if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                            nfd["field_enterprise_number"], = struct.unpack(">I", data[nfdec_pos:nfdec_pos + nfdec_size])
+                            nfd["field_enterprise_number"], = NetFlowStructs.Enterprise.unpack_from(data, nfdec_pos)
                             nfdec_pos += nfdec_size
 
                         else:
@@ -920,15 +1497,27 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
                             return
                         i += 1
 
+                    nfd_template_unpack = struct.Struct(nfd_template_unpack)
+
+                    # Resolve record fields once per template instead of once per flow record.
+                    nfd_template_fields = []
+                    nfd_template_defaults = {}
+                    for nf_data_type, nf_field_name, nf_field_default, nf_field_format in NetFlowRecord.Fields:
+                        if nf_data_type in nfd_template_struct:
+                            nfd_template_fields.append((nf_field_name, nfd_template_struct[nf_data_type][0], nf_field_format))
+                        else:
+                            nfd_template_defaults[nf_field_name] = nf_field_default
+                    nfd_template_fields = tuple(nfd_template_fields)
+
                     with lock:
                         template_id = "template-v" + str(nfd["version"]) + "-t" + str(nfd["template_id"]) + "-d" + str(nfd["domain_id"])
 
                         if template_id in netflow_sources[nfd["msg_src_ip"]].keys():
-                            netflow_sources[nfd["msg_src_ip"]][template_id] = (nfd_template_size, nfd_template, nfd_template_unpack, nfd_template_struct)
+                            netflow_sources[nfd["msg_src_ip"]][template_id] = (nfd_template_size, nfd_template, nfd_template_unpack, nfd_template_struct, nfd_template_fields, nfd_template_defaults)
 
                         else:
                             netflow_sources[nfd["msg_src_ip"]][template_id] = {}
-                            netflow_sources[nfd["msg_src_ip"]][template_id] = (nfd_template_size, nfd_template, nfd_template_unpack, nfd_template_struct)
+                            netflow_sources[nfd["msg_src_ip"]][template_id] = (nfd_template_size, nfd_template, nfd_template_unpack, nfd_template_struct, nfd_template_fields, nfd_template_defaults)
 
                     if config["debug"]:
                         sys.stdout.write("NPP/%s/v%s/%s/%s/Processed.\n" % (nfd["msg_src_ip"], nfd["version"], nfd["template_id"], nfd["msg_type"]))
@@ -954,183 +1543,44 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
 
                 template_id = "template-v" + str(nfd["version"]) + "-t" + str(nfd["field_info_element_id"]) + "-d" + str(nfd["domain_id"])
                 if template_id in netflow_sources[nfd["msg_src_ip"]].keys():
+                    nf_template = netflow_sources[nfd["msg_src_ip"]][template_id]
+                    nf_template_unpack = nf_template[NetFlowTemplates.Unpack].unpack_from
+                    nf_template_fields = nf_template[NetFlowTemplates.Fields]
+                    nf_template_defaults = nf_template[NetFlowTemplates.Defaults]
+
                     # Calculate padding.
-                    nf_data_padding = ((nfd["msg_size"] - nfdec_pos) % (netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Size])) % 4
+                    nfdec_size = nf_template[NetFlowTemplates.Size]
+                    nf_data_padding = ((nfd["msg_size"] - nfdec_pos) % nfdec_size) % 4
 
+                    nfd_flows = []
                     while nfdec_pos != nfd["msg_size"] - nf_data_padding:
                         with lock:
                             netflow_sources["flows_received"] += 1
 
-                        nfdec_size = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Size]
                         if (nfd["msg_size"] - nfdec_pos) >= nfdec_size:
-                            nf_data = struct.unpack(netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Unpack], data[nfdec_pos:nfdec_pos + nfdec_size])
+                            nf_data = nf_template_unpack(data, nfdec_pos)
                             nfdec_pos += nfdec_size
                         else:
                             if config["debug"]:
                                 sys.stdout.write("NPP/%s/v%s/%s/Not enough data left.\n" % (nfd["msg_src_ip"], nfd["version"], nfd["msg_type"]))
                                 sys.stdout.flush()
+                            flow_processor(nfd_flows)
                             return
 
-                        if NetFlowDataTypes.IPv4_Src_Addr in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv4_Src_Addr][0]
-                            nfd["src_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nf_data[nf_data_loc]))
-                        else:
-                            nfd["src_ip4"] = None
-
-                        if NetFlowDataTypes.IPv4_Dst_Addr in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv4_Dst_Addr][0]
-                            nfd["dst_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nf_data[nf_data_loc]))
-                        else:
-                            nfd["dst_ip4"] = None
-
-                        if NetFlowDataTypes.IPv4_Next_Hop in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv4_Next_Hop][0]
-                            nfd["nexthop_ip4"] = socket.inet_ntop(socket.AF_INET, struct.pack("!L", nf_data[nf_data_loc]))
-                        else:
-                            nfd["nexthop_ip4"] = None
-
-                        if NetFlowDataTypes.IPv6_Src_Addr in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv6_Src_Addr][0]
-                            nfd["src_ip6"] = socket.inet_ntop(socket.AF_INET6, struct.pack("!2Q", nf_data[nf_data_loc], nf_data[nf_data_loc + 1]))
-                        else:
-                            nfd["src_ip6"] = None
-
-                        if NetFlowDataTypes.IPv6_Dst_Addr in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv6_Dst_Addr][0]
-                            nfd["dst_ip6"] = socket.inet_ntop(socket.AF_INET6, struct.pack("!2Q", nf_data[nf_data_loc], nf_data[nf_data_loc + 1]))
-                        else:
-                            nfd["dst_ip6"] = None
-
-                        if NetFlowDataTypes.IPv6_Next_Hop in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv6_Next_Hop][0]
-                            nfd["nexthop_ip6"] = socket.inet_ntop(socket.AF_INET6, struct.pack("!2Q", nf_data[nf_data_loc], nf_data[nf_data_loc + 1]))
-                        else:
-                            nfd["nexthop_ip6"] = None
+                        # Fields missing in the template, then fields present in the template.
+                        nfd.update(nf_template_defaults)
+                        for nf_field_name, nf_data_loc, nf_field_format in nf_template_fields:
+                            if nf_field_format == NetFlowFieldFormat.Value:
+                                nfd[nf_field_name] = nf_data[nf_data_loc]
+                            elif nf_field_format == NetFlowFieldFormat.IPv4:
+                                nfd[nf_field_name] = IPv4_ntoa(nf_data[nf_data_loc])
+                            else:
+                                nfd[nf_field_name] = socket.inet_ntop(socket.AF_INET6, NetFlowStructs.IPv6.pack(nf_data[nf_data_loc], nf_data[nf_data_loc + 1]))
 
-                        if NetFlowDataTypes.Src_AS in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Src_AS][0]
-                            nfd["src_as"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["src_as"] = None
-
-                        if NetFlowDataTypes.Dst_AS in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Dst_AS][0]
-                            nfd["dst_as"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["dst_as"] = None
+                        nfd_flows.append(dict(nfd))
 
-                        if NetFlowDataTypes.Input_SNMP in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Input_SNMP][0]
-                            nfd["in_interface"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["in_interface"] = 0
-
-                        if NetFlowDataTypes.Output_SNMP in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Output_SNMP][0]
-                            nfd["out_interface"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["out_interface"] = 0
-
-                        if NetFlowDataTypes.In_Bytes in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.In_Bytes][0]
-                            nfd["in_bytes"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["in_bytes"] = 0
-
-                        if NetFlowDataTypes.Out_Bytes in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Out_Bytes][0]
-                            nfd["out_bytes"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["out_bytes"] = 0
-
-                        if NetFlowDataTypes.In_Packets in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.In_Packets][0]
-                            nfd["in_packets"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["in_packets"] = 0
-
-                        if NetFlowDataTypes.Out_Packets in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Out_Packets][0]
-                            nfd["out_packets"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["out_packets"] = 0
-
-                        if NetFlowDataTypes.First_Switched in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.First_Switched][0]
-                            nfd["flow_first"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["flow_first"] = 0
-
-                        if NetFlowDataTypes.Last_Switched in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Last_Switched][0]
-                            nfd["flow_last"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["flow_last"] = 0
-
-                        if NetFlowDataTypes.L4_Src_Port in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.L4_Src_Port][0]
-                            nfd["src_port"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["src_port"] = None
-
-                        if NetFlowDataTypes.L4_Dst_Port in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.L4_Dst_Port][0]
-                            nfd["dst_port"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["dst_port"] = None
-
-                        if NetFlowDataTypes.TCP_Flags in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.TCP_Flags][0]
-                            nfd["tcp_flags"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["tcp_flags"] = None
-
-                        if NetFlowDataTypes.Protocol in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Protocol][0]
-                            nfd["proto"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["proto"] = None
-
-                        if NetFlowDataTypes.Src_TOS in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Src_TOS][0]
-                            nfd["src_tos"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["src_tos"] = None
-
-                        if NetFlowDataTypes.Dst_TOS in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Dst_TOS][0]
-                            nfd["dst_tos"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["dst_tos"] = None
-
-                        if NetFlowDataTypes.Src_Mask in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Src_Mask][0]
-                            nfd["src_mask4"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["src_mask4"] = None
-
-                        if NetFlowDataTypes.Dst_Mask in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.Dst_Mask][0]
-                            nfd["dst_mask4"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["dst_mask4"] = None
-
-                        if NetFlowDataTypes.IPv6_Src_Mask in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv6_Src_Mask][0]
-                            nfd["src_mask6"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["src_mask6"] = None
-
-                        if NetFlowDataTypes.IPv6_Dst_Mask in netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct]:
-                            nf_data_loc = netflow_sources[nfd["msg_src_ip"]][template_id][NetFlowTemplates.Struct][NetFlowDataTypes.IPv6_Dst_Mask][0]
-                            nfd["dst_mask6"] = nf_data[nf_data_loc]
-                        else:
-                            nfd["dst_mask6"] = None
-
-                        NetFlow_FlowProcessor(adns_resolver, nfd)
-
-                        with lock:
-                            netflow_sources["flows_processed"] += 1
+                    # Flows of the whole packet are processed at once.
+                    flow_processor(nfd_flows)
 
                 else:
                     if config["debug"]:
@@ -1176,7 +1626,7 @@ def NetFlow_PacketProcessor(adns_resolver, nf_src_ip, data):
 
 
 def GIXFlow():
-    global Running, prefix_cache
+    global Running, prefix_cache, netflow_queue
 
     try:
         if config["debug"]:
@@ -1202,20 +1652,49 @@ def GIXFlow():
         sqlite_con.close()
         pass
 
+    if config["forwardto_enable"]:
+        NetFlow_Forward_Init()
+        if config["debug"]:
+            sys.stdout.write("GF/Forwarding NetFlow packets to %s.\n" % (str(fwd_addr)))
+            sys.stdout.flush()
+
+    # NetFlow worker processes are forked before any other thread is started.
+    netflow_processes = NetFlow_Processes()
+    if netflow_processes:
+        report_queue = multiprocessing.Queue()
+        packet_queues = []
+        # The process queues share the NetFlow queue size, minus the batches handed over to the NetFlow workers.
+        packet_queue_size = max(1, NetFlow_Queue_Size() // netflow_processes - config["netflow_workers"])
+        for i in range(netflow_processes):
+            packet_queue = multiprocessing.Queue(maxsize=packet_queue_size)
+            netflowp = multiprocessing.Process(target=NetFlow_Process, args=(i, packet_queue, report_queue))
+            netflowp.daemon = True
+            netflowp.start()
+            packet_queues.append(packet_queue)
+            if config["debug"]:
+                sys.stdout.write("GF/NetFlow worker process %s started.\n" % (i))
+                sys.stdout.flush()
+        netflow_queue = ProcessQueues(packet_queues)
+
+        netflows = threading.Thread(target=NetFlow_Process_Stats, args=(report_queue,))
+        netflows.daemon = True
+        netflows.start()
+
     statsd = threading.Thread(target=Stats_Worker)
     statsd.daemon = True
     statsd.start()
 
     netflowd = {}
     netflowd_nb = 0
-    for i in range(config["netflow_workers"]):
-        netflowd[netflowd_nb] = threading.Thread(target=NetFlow_Worker)
-        netflowd[netflowd_nb].daemon = True
-        netflowd[netflowd_nb].start()
-        netflowd_nb += 1
-        if config["debug"]:
-            sys.stdout.write("GF/NetFlow worker %s started.\n" % (i))
-            sys.stdout.flush()
+    if not netflow_processes:
+        for i in range(config["netflow_workers"]):
+            netflowd[netflowd_nb] = threading.Thread(target=NetFlow_Worker)
+            netflowd[netflowd_nb].daemon = True
+            netflowd[netflowd_nb].start()
+            netflowd_nb += 1
+            if config["debug"]:
+                sys.stdout.write("GF/NetFlow worker %s started.\n" % (i))
+                sys.stdout.flush()
 
     if config["flow_ipv4_enable"]:
         netrecvd = "ipv4"
@@ -1302,7 +1781,7 @@ if __name__ == '__main__':
             prefix_cache = RFCPrefixTable()
 
             # Initialize a queue for NetFlow workers.
-            netflow_queue = Queue.Queue(maxsize=config["netflow_queue"])
+            netflow_queue = RingQueue(maxsize=NetFlow_Queue_Size())
 
             # Initialize a lock.
             lock = threading.RLock()
@@ -1330,7 +1809,7 @@ if __name__ == '__main__':
             prefix_cache = RFCPrefixTable()
 
             # Initialize a queue for NetFlow workers.
-            netflow_queue = Queue.Queue(maxsize=config["netflow_queue"])
+            netflow_queue = RingQueue(maxsize=NetFlow_Queue_Size())
 
             # Initialize a lock.
             lock = threading.RLock()
@@ -4,6 +4,7 @@ Created by Daniel Piekacz on 2014-06-01.
 Updated on 2014-11-11.
 https://gixtools.net
 """
+import struct
 
 
 class NetflowMessageID:
@@ -20,6 +21,28 @@ class NetFlowTemplates:
     Template = 1
     Unpack = 2
     Struct = 3
+    Fields = 4
+    Defaults = 5
+
+
+class NetFlowFieldFormat:
+    Value = 0
+    IPv4 = 1
+    IPv6 = 2
+
+
+class NetFlowStructs:
+    Version = struct.Struct(">H")
+    V1_Header = struct.Struct(">HIII")
+    V1_Record = struct.Struct(">IIIHHIIIIHHHBBBBBBI")
+    V5_Header = struct.Struct(">HIIIIBBH")
+    V5_Record = struct.Struct(">IIIHHIIIIHHBBBBHHBBH")
+    V9_Header = struct.Struct(">HIIIIHH")
+    V10_Header = struct.Struct(">HIIIHH")
+    Enterprise = struct.Struct(">I")
+    Template_Header = struct.Struct(">HH")
+    IPv4 = struct.Struct("!L")
+    IPv6 = struct.Struct("!2Q")
 
 
 class NetFlowDataTypes:
@@ -129,11 +152,72 @@ class NetFlowDataTypes:
     Layer2_Packet_Section_Data = 104
 
 
+class NetFlowRecord:
+    # NetFlow v9/v10 data type, flow record key, value when missing in a template, field format.
+    Fields = (
+        (NetFlowDataTypes.IPv4_Src_Addr, "src_ip4", None, NetFlowFieldFormat.IPv4),
+        (NetFlowDataTypes.IPv4_Dst_Addr, "dst_ip4", None, NetFlowFieldFormat.IPv4),
+        (NetFlowDataTypes.IPv4_Next_Hop, "nexthop_ip4", None, NetFlowFieldFormat.IPv4),
+        (NetFlowDataTypes.IPv6_Src_Addr, "src_ip6", None, NetFlowFieldFormat.IPv6),
+        (NetFlowDataTypes.IPv6_Dst_Addr, "dst_ip6", None, NetFlowFieldFormat.IPv6),
+        (NetFlowDataTypes.IPv6_Next_Hop, "nexthop_ip6", None, NetFlowFieldFormat.IPv6),
+        (NetFlowDataTypes.Src_AS, "src_as", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Dst_AS, "dst_as", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Input_SNMP, "in_interface", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Output_SNMP, "out_interface", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.In_Bytes, "in_bytes", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Out_Bytes, "out_bytes", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.In_Packets, "in_packets", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Out_Packets, "out_packets", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.First_Switched, "flow_first", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Last_Switched, "flow_last", 0, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.L4_Src_Port, "src_port", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.L4_Dst_Port, "dst_port", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.TCP_Flags, "tcp_flags", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Protocol, "proto", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Src_TOS, "src_tos", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Dst_TOS, "dst_tos", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Src_Mask, "src_mask4", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.Dst_Mask, "dst_mask4", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.IPv6_Src_Mask, "src_mask6", None, NetFlowFieldFormat.Value),
+        (NetFlowDataTypes.IPv6_Dst_Mask, "dst_mask6", None, NetFlowFieldFormat.Value),
+    )
+
+
 class ASNtype:
     Internal = 0
     Unknown = 4294967295
 
 
+class ASNCache:
+    # Maximum number of IPv4 /24 networks kept in the ASN cache.
+    Size = 1000000
+    Prefixlen = 24
+
+
+class IPv4Cache:
+    # Maximum number of IPv4 addresses kept as strings, hot addresses repeat across flow records.
+    Size = 65536
+
+
+class NetFlowProcess:
+    # Counters reported by NetFlow worker processes to the main process, as deltas.
+    Counters = (
+        "v4_packets_processed", "v6_packets_processed", "flows_received", "flows_processed", "dns_queries",
+        "proto_tcp_bytes", "proto_tcp_packets", "proto_udp_bytes", "proto_udp_packets", "proto_icmp_bytes",
+        "proto_icmp_packets", "proto_ipv6_bytes", "proto_ipv6_packets", "proto_other_bytes", "proto_other_packets",
+    )
+    # Counters reported per NetFlow source.
+    SourceCounters = ("v4_packets_processed", "v6_packets_processed")
+    # Seconds between two reports.
+    ReportInterval = 1
+
+
+class NegCache:
+    # Maximum number of networks kept in the negative cache, least recently used are evicted first.
+    Size = 100000
+
+
 class PrefixExpire:
     # Never - For RFC special IP networks and known prefixes.
     Never = 0
@@ -143,6 +227,15 @@ class PrefixExpire:
     Short = 7200
 
 
+class SQLite_Dump:
+    # Number of rows per executemany call when dumping the prefix cache.
+    # 50-500 rows per batch performs best, larger batches only hold the GIL longer.
+    BatchSize = 500
+    # Number of rows per multi-row INSERT statement (SQLite 3.7.11 and newer), 3 columns each,
+    # well below the limit of 999 parameters per statement. BatchSize should be a multiple of it.
+    RowsPerInsert = 25
+
+
 class Protocols:
     ICMP = 1
     TCP = 6
@@ -170,3 +263,4 @@ class TCPflags:
 class IP2ASN_def_mask:
     IPv4 = "24"
     IPv6 = "48"
+    IPv4_Netmask = 0xFFFFFF00
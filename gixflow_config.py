@@ -29,16 +29,36 @@ config["flow_ipv4"] = "198.51.100.255"
 config["flow_ipv6_enable"] = True
 config["flow_ipv6"] = "2001:db8::ffff"
 
-# Size of the NetFlow queue.
+# Receive buffer size of the NetFlow sockets, absorbs bursts of NetFlow packets.
+# Linux limits the value to net.core.rmem_max, raise it with:
+# sysctl -w net.core.rmem_max=12582912
+config["flow_rcvbuf"] = 12 * 1024 * 1024
+
+# Maximum number of NetFlow packets received with a single recvmmsg() call.
+# Received packets are queued in batches of up to this size.
+config["flow_recv_batch"] = 64
+
+# Size of the NetFlow queue (in packets).
+# Packets are queued in batches of up to flow_recv_batch packets, the queue holds netflow_queue / flow_recv_batch batches.
 config["netflow_queue"] = 50000
 
-# Number of NetFlow workers.
+# Number of NetFlow workers (per NetFlow worker process).
 config["netflow_workers"] = 10
 
+# Number of NetFlow worker processes, packets of an exporter are always decoded by the same process.
+# 0 - NetFlow workers run as threads of the main process. None - Number of CPUs minus one.
+config["netflow_processes"] = None
+
+# Pin NetFlow receivers to a dedicated CPU, NetFlow workers use the remaining CPUs.
+config["cpu_affinity_enable"] = True
+config["flow_receiver_cpu"] = 0
+
 # Enable/Disable: Forwarding NetFlow data to another collector.
 config["forwardto_enable"] = False
 config["forwardto_ip"] = "127.0.0.1"
 config["forwardto_port"] = 2100
+# Send buffer of the forwarding socket, a single socket is shared by all NetFlow workers.
+config["forwardto_sndbuf"] = 4 * 1024 * 1024
 
 # Enable IP2ASN lookup using Cymru DNS service.
 # Keep in mind that the process may generate thousands of DNS queries
@@ -0,0 +1,142 @@
+"""
+gixflow_queue.py
+https://gixtools.net
+"""
+import time
+import threading
+import collections
+import Queue
+
+
+class RingQueue(object):
+    # Bounded FIFO queue with the put/get/qsize interface of Queue.Queue.
+    #
+    # Items are stored in a collections.deque, append() and popleft() are atomic
+    # so neither put() nor get() takes a lock while the queue has items in it.
+    # The event is only touched to wake up consumers when the queue runs empty.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = collections.deque()
+        self.ready = threading.Event()
+
+    def qsize(self):
+        return len(self.items)
+
+    # Number of packets in the queued batches, computed on a copy of the deque
+    # instead of a counter updated by put() and get(), which would need a lock.
+    def qsize_packets(self):
+        return sum([len(item) for item in list(self.items)])
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    # Never blocks, raises Queue.Full as Queue.Queue.put(block=False) does.
+    def put(self, item, block=False):
+        if len(self.items) >= self.maxsize:
+            raise Queue.Full
+
+        self.items.append(item)
+        if not self.ready.is_set():
+            self.ready.set()
+
+    def get(self, block=True, timeout=None):
+        try:
+            return self.items.popleft()
+
+        except IndexError:
+            if not block:
+                raise Queue.Empty
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            self.ready.clear()
+            # An item could have been added before the event was cleared.
+            try:
+                return self.items.popleft()
+
+            except IndexError:
+                pass
+
+            if timeout is None:
+                self.ready.wait()
+
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Queue.Empty
+                self.ready.wait(remaining)
+
+            try:
+                return self.items.popleft()
+
+            except IndexError:
+                pass
+
+
+class ProcessQueues(object):
+    # Distributes batches of [source IP address, data] pairs to the queues of NetFlow worker processes.
+    # All packets of a NetFlow source go to the same process, which holds the templates of the source.
+    #
+    # Packets are counted when queued here and when taken by a process, as reported by the process.
+    # Processes also report the packets waiting in their local queue.
+    def __init__(self, queues):
+        self.queues = queues
+        self.lock = threading.Lock()
+        self.packets_queued = [0] * len(queues)
+        self.packets_local = [0] * len(queues)
+
+    def qsize(self):
+        size = 0
+        for queue in self.queues:
+            try:
+                size += queue.qsize()
+            except NotImplementedError:
+                pass
+
+        return size
+
+    def qsize_packets(self):
+        with self.lock:
+            return sum(self.packets_queued) + sum(self.packets_local)
+
+    def process_report(self, queue_id, packets_taken, packets_local):
+        with self.lock:
+            self.packets_queued[queue_id] -= packets_taken
+            self.packets_local[queue_id] = packets_local
+
+    # Never blocks, raises Queue.Full when at least one of the batches could not be queued.
+    def put(self, packets, block=False):
+        queues_nb = len(self.queues)
+        batches = [[] for queue in self.queues]
+        for packet in packets:
+            batches[hash(packet[0]) % queues_nb].append(packet)
+
+        full = False
+        for queue_id, queue in enumerate(self.queues):
+            batch = batches[queue_id]
+            if batch:
+                try:
+                    queue.put(batch, block=False)
+                except Queue.Full:
+                    full = True
+                    continue
+
+                with self.lock:
+                    self.packets_queued[queue_id] += len(batch)
+
+        if full:
+            raise Queue.Full
+
+    # Sends an item to every process except skip_id, dropped for processes with a full queue.
+    def broadcast(self, item, skip_id=None):
+        for queue_id, queue in enumerate(self.queues):
+            if queue_id != skip_id:
+                try:
+                    queue.put(item, block=False)
+                except Queue.Full:
+                    pass
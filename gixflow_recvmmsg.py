@@ -0,0 +1,119 @@
+"""
+gixflow_recvmmsg.py
+https://gixtools.net
+"""
+import os
+import errno
+import struct
+import socket
+import ctypes
+import ctypes.util
+
+
+# Return as soon as at least one datagram has been received.
+MSG_WAITFORONE = 0x10000
+
+# Large enough for struct sockaddr_in and struct sockaddr_in6.
+SOCKADDR_SIZE = 128
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+class RecvMMsg(object):
+    # Receives up to vlen datagrams with a single recvmmsg() system call.
+    # Buffers are allocated once and reused for every call.
+    def __init__(self, sock, vlen, size):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # Raises AttributeError when libc does not provide recvmmsg().
+        self.libc_recvmmsg = libc.recvmmsg
+        self.libc_recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self.libc_recvmmsg.restype = ctypes.c_int
+
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.vlen = vlen
+        self.size = size
+
+        self.buffers = (ctypes.c_char * (size * vlen))()
+        self.names = (ctypes.c_char * (SOCKADDR_SIZE * vlen))()
+        self.iovecs = (iovec * vlen)()
+        self.msgs = (mmsghdr * vlen)()
+
+        buffers_addr = ctypes.addressof(self.buffers)
+        names_addr = ctypes.addressof(self.names)
+        for i in range(vlen):
+            self.iovecs[i].iov_base = buffers_addr + i * size
+            self.iovecs[i].iov_len = size
+            self.msgs[i].msg_hdr.msg_name = names_addr + i * SOCKADDR_SIZE
+            self.msgs[i].msg_hdr.msg_namelen = SOCKADDR_SIZE
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def recv(self):
+        # Returns a list of [source IP address, data] pairs.
+        for i in range(self.vlen):
+            self.msgs[i].msg_hdr.msg_namelen = SOCKADDR_SIZE
+
+        msgs_nb = self.libc_recvmmsg(self.fd, self.msgs, self.vlen, MSG_WAITFORONE, None)
+        if msgs_nb == -1:
+            e = ctypes.get_errno()
+            if e == errno.EINTR:
+                return []
+            raise socket.error(e, os.strerror(e))
+
+        packets = []
+        names_addr = ctypes.addressof(self.names)
+        buffers_addr = ctypes.addressof(self.buffers)
+        for i in range(msgs_nb):
+            name = ctypes.string_at(names_addr + i * SOCKADDR_SIZE, 24)
+            family, = struct.unpack("=H", name[0:2])
+            if family == socket.AF_INET:
+                ipaddr = socket.inet_ntop(socket.AF_INET, name[4:8])
+            else:
+                ipaddr = socket.inet_ntop(socket.AF_INET6, name[8:24])
+            packets.append([ipaddr, ctypes.string_at(buffers_addr + i * self.size, self.msgs[i].msg_len)])
+
+        return packets
+
+
+class RecvFrom(object):
+    # Fallback when recvmmsg() is not available, receives a single datagram per call.
+    def __init__(self, sock, vlen, size):
+        self.sock = sock
+        self.size = size
+
+    def recv(self):
+        data, ipaddr = self.sock.recvfrom(self.size)
+        return [[ipaddr[0], data]]
+
+
+def RecvInit(sock, vlen, size):
+    try:
+        return RecvMMsg(sock, vlen, size)
+
+    except (AttributeError, OSError):
+        return RecvFrom(sock, vlen, size)